@@ -1,12 +1,30 @@
-import json
+import asyncio
+import concurrent.futures
+import csv
+import hashlib
+import io
 import os
 import re
-import sys
+import threading
 
+import orjson
 import streamlit as st
-import pandas as pd
-import pdfplumber
-from PIL import Image
+
+from extraction import cache_key
+from ingestion import extract_text_from_image, extract_text_from_pdf
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Groq requests in flight at once, across every session sharing the key
+MAX_CONCURRENCY = 16
+
+# Threads extracting text from uploads while earlier files wait on Groq
+EXTRACTION_WORKERS = 4
+
+# Groq free-tier limits are 30 requests / 6,000 tokens per minute; pace
+# slightly under them so bursts don't end in 429s.
+GROQ_REQUESTS_PER_MINUTE = 28
+GROQ_TOKENS_PER_MINUTE = 5500
 
 st.set_page_config(
     page_title="Parserix - GST Invoice Extractor",
@@ -34,13 +52,18 @@ if not st.session_state.authenticated:
     col_left, col_center, col_right = st.columns([1, 2, 1])
     with col_center:
         st.markdown("")  # spacer
-        access_code = st.text_input(
-            "Beta Access Code",
-            type="password",
-            placeholder="Enter your access code",
-        )
-
-        if st.button("Unlock Access", use_container_width=True, type="primary"):
+        # A form only reruns the script on submit, not on every keystroke
+        with st.form("beta_access", border=False):
+            access_code = st.text_input(
+                "Beta Access Code",
+                type="password",
+                placeholder="Enter your access code",
+            )
+            submitted = st.form_submit_button(
+                "Unlock Access", use_container_width=True, type="primary"
+            )
+
+        if submitted:
             try:
                 passcode = st.secrets["BETA_PASSCODE"]
             except (FileNotFoundError, KeyError):
@@ -79,14 +102,18 @@ if not st.session_state.user_email:
 
     col_left, col_center, col_right = st.columns([1, 2, 1])
     with col_center:
-        email_input = st.text_input(
-            "Your Email",
-            placeholder="you@example.com",
-        )
-
-        if st.button("Continue", use_container_width=True, type="primary"):
+        with st.form("email_gate", border=False):
+            email_input = st.text_input(
+                "Your Email",
+                placeholder="you@example.com",
+            )
+            submitted = st.form_submit_button(
+                "Continue", use_container_width=True, type="primary"
+            )
+
+        if submitted:
             email = email_input.strip().lower()
-            if not email or not re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", email):
+            if not email or not _EMAIL_RE.match(email):
                 st.error("Please enter a valid email address.")
             else:
                 st.session_state.user_email = email
@@ -101,7 +128,14 @@ if not st.session_state.user_email:
 #  AUTHENTICATED + IDENTIFIED — Main App below
 # =========================================================================
 
-from db import get_upload_count, increment_upload_count, get_remaining_quota, MAX_UPLOADS
+from db import (
+    get_upload_count,
+    increment_upload_count_async,
+    get_remaining_quota,
+    get_cached_extraction_async,
+    save_cached_extraction_async,
+    MAX_UPLOADS,
+)
 
 user_email = st.session_state.user_email
 current_usage = get_upload_count(user_email)
@@ -150,128 +184,246 @@ with st.sidebar:
         "- Grand Total"
     )
     st.divider()
-    st.caption("Powered by Groq · Llama 4 Scout 17B")
+    st.caption("Powered by Groq · Llama 3.1 8B Instant")
 
 # ---------------------------------------------------------------------------
-# Tesseract availability check (lazy — only when OCR is actually needed)
+# Confidence display helper
 # ---------------------------------------------------------------------------
 
-def _check_tesseract() -> bool:
-    """Return True if Tesseract is available, False otherwise."""
-    try:
-        import pytesseract
-        # Try common Windows install path if not on PATH
-        if sys.platform == "win32":
-            default = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-            if os.path.isfile(default):
-                pytesseract.pytesseract.tesseract_cmd = default
-        pytesseract.get_tesseract_version()
-        return True
-    except Exception:
-        return False
+def _render_confidence(confidence: dict) -> None:
+    """Render confidence scores as one table with progress bars and color-coded levels."""
+    import numpy as np
+    import pandas as pd
+
+    st.subheader("Confidence Scores")
+    scores = (
+        pd.to_numeric(pd.Series(confidence), errors="coerce")
+        .fillna(0)
+        .clip(0, 100)  # clamp 0-100
+        .astype(int)
+    )
+    levels = np.select(
+        [scores > 90, scores >= 70], ["🟢 High", "🟡 Medium"], default="🔴 Low"
+    )
+    df = pd.DataFrame({
+        "Field": [field.replace("_", " ").title() for field in scores.index],
+        "Score": scores.to_numpy(),
+        "Level": levels,
+    })
+    st.dataframe(
+        df,
+        column_config={
+            "Score": st.column_config.ProgressColumn(
+                min_value=0, max_value=100, format="%d%%"
+            ),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
 
 
 # ---------------------------------------------------------------------------
-# Text extraction helpers
+# Batch pipeline
 # ---------------------------------------------------------------------------
 
-def extract_text_from_pdf(uploaded_file) -> str:
-    """Extract text from a PDF using pdfplumber. Falls back to OCR for scanned PDFs."""
-    text_parts = []
-    with pdfplumber.open(uploaded_file) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text_parts.append(page_text)
-
-    if text_parts:
-        return "\n".join(text_parts)
-
-    # Fallback: render pages as images via PyMuPDF and OCR them
-    return _ocr_scanned_pdf(uploaded_file)
-
-
-def _ocr_scanned_pdf(uploaded_file) -> str:
-    """Render PDF pages to images with PyMuPDF, then OCR with Tesseract."""
-    import fitz  # PyMuPDF
-    import pytesseract
-
-    if not _check_tesseract():
-        raise EnvironmentError(
-            "Tesseract OCR is not installed. This scanned PDF requires OCR.\n\n"
-            "**Install Tesseract on Windows:**\n"
-            "1. Download from https://github.com/UB-Mannheim/tesseract/wiki\n"
-            "2. Install and add to your system PATH.\n"
-            "3. Restart this app."
-        )
+@st.cache_resource
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop that runs all batch I/O, started once per server.
 
-    uploaded_file.seek(0)
-    pdf_bytes = uploaded_file.read()
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-    text_parts = []
-    for page in doc:
-        pix = page.get_pixmap(dpi=300)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        page_text = pytesseract.image_to_string(img, lang="eng")
-        if page_text.strip():
-            text_parts.append(page_text)
-    doc.close()
-
-    if not text_parts:
-        raise ValueError(
-            "Could not extract any text from this scanned PDF. "
-            "Please ensure the document is legible."
-        )
-    return "\n".join(text_parts)
+    The loop lives on a daemon thread instead of a fresh ``asyncio.run()``
+    per rerun, so cached async clients keep their keep-alive connection
+    pools (which are bound to the loop) from one rerun to the next.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="parserix-io", daemon=True).start()
+    return loop
 
 
-def extract_text_from_image(uploaded_file) -> str:
-    """Extract text from an image using Pillow + Tesseract OCR."""
-    import pytesseract
+@st.cache_resource
+def _get_extraction_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Return the thread pool used for text extraction, shared across reruns.
 
-    if not _check_tesseract():
-        raise EnvironmentError(
-            "Tesseract OCR is not installed.\n\n"
-            "**Install Tesseract on Windows:**\n"
-            "1. Download from https://github.com/UB-Mannheim/tesseract/wiki\n"
-            "2. Install and add to your system PATH.\n"
-            "3. Restart this app."
-        )
+    PyMuPDF, Pillow and Tesseract do their work outside the GIL, so threads
+    overlap well with each other and with in-flight Groq requests.
+    """
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=EXTRACTION_WORKERS, thread_name_prefix="parserix-extract"
+    )
 
-    image = Image.open(uploaded_file)
-    text = pytesseract.image_to_string(image, lang="eng")
-    if not text.strip():
-        raise ValueError(
-            "OCR could not extract any text from this image. "
-            "Ensure the image is clear and contains readable text."
-        )
-    return text
 
+@st.cache_resource
+def _get_rate_limiter():
+    """Return the Groq rate limiter shared by every session and rerun."""
+    from extraction.rate_limit import AsyncTokenBucket
 
-# ---------------------------------------------------------------------------
-# Confidence display helper
-# ---------------------------------------------------------------------------
+    return AsyncTokenBucket(
+        requests_per_minute=GROQ_REQUESTS_PER_MINUTE,
+        tokens_per_minute=GROQ_TOKENS_PER_MINUTE,
+    )
 
-def _render_confidence(confidence: dict) -> None:
-    """Render confidence scores with progress bars and color-coded labels."""
-    st.subheader("Confidence Scores")
-    for field, score in confidence.items():
-        label = field.replace("_", " ").title()
-        score = max(0, min(100, int(score)))  # clamp 0-100
 
-        if score > 90:
-            icon, level = "🟢", "High"
-        elif score >= 70:
-            icon, level = "🟡", "Medium"
-        else:
-            icon, level = "🔴", "Low"
+@st.cache_resource
+def _get_loader(api_key: str):
+    """Return the request loader for ``api_key``, shared by every session and rerun.
 
-        col_label, col_bar = st.columns([1, 2])
-        with col_label:
-            st.markdown(f"{icon} **{label}** — {score}% *({level})*")
-        with col_bar:
-            st.progress(score / 100)
+    Requests from concurrent sessions and batches are coalesced by one
+    drain task on the shared event loop, so MAX_CONCURRENCY and the rate
+    limiter bound the whole server rather than each batch separately.
+    """
+    from extraction.loader import ExtractionLoader
+
+    return ExtractionLoader(
+        api_key=api_key,
+        limiter=_get_rate_limiter(),
+        max_batch_size=MAX_CONCURRENCY,
+        max_concurrency=MAX_CONCURRENCY,
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _extract_text(file_bytes: bytes, file_type: str) -> str:
+    """Extract raw text from an upload's bytes, cached on the file contents.
+
+    Widget interactions rerun the whole script; this keeps reruns from
+    re-parsing (and re-OCR'ing) files that are still uploaded.
+    """
+    if file_type == "application/pdf":
+        return extract_text_from_pdf(file_bytes)
+    return extract_text_from_image(file_bytes)
+
+
+def _response_cache_key(raw_text: str, api_key: str) -> str:
+    """Hash the whitespace-normalized request together with a digest of the API key.
+
+    Only a digest of the key ends up in the cache, and rotating the key
+    invalidates entries produced with the old one. Building on the
+    extractor's cache_key means prompt or model changes invalidate them too.
+    """
+    normalized = " ".join(raw_text.split())
+    key_digest = hashlib.sha256(api_key.encode()).hexdigest()
+    return hashlib.sha256(f"{key_digest}:{cache_key(normalized)}".encode()).hexdigest()
+
+
+async def _process_one(uploaded_file, api_key: str, extraction_pool, loader) -> dict:
+    """Run text extraction + AI extraction for one file.
+
+    Extraction runs on the extraction pool as soon as the batch starts;
+    only the Groq call goes through the loader and waits for a free slot, so
+    later files are already extracted by the time one frees up.
+
+    Fresh results are charged and cached afterwards by _settle_batch, once
+    for the whole batch.
+
+    Nothing is rendered here: the outcome (or the error that stopped the
+    pipeline) is returned so results can be shown in upload order.
+    """
+    outcome = {
+        "raw_text": None,
+        "text_error": None,
+        "result": None,
+        "ai_error": None,
+        "cached": False,
+        "usage_error": None,
+        "response_key": None,
+    }
+    try:
+        raw_text = await asyncio.get_running_loop().run_in_executor(
+            extraction_pool,
+            _extract_text,
+            uploaded_file.getvalue(),
+            uploaded_file.type,
+        )
+    except (ValueError, EnvironmentError) as e:
+        outcome["text_error"] = str(e)
+        return outcome
+    except Exception as e:
+        outcome["text_error"] = f"Text extraction failed: {e}"
+        return outcome
+    outcome["raw_text"] = raw_text
+
+    # The response cache is best-effort: if Supabase is unreachable we
+    # simply fall through to a fresh Groq call.
+    response_key = outcome["response_key"] = _response_cache_key(raw_text, api_key)
+    try:
+        cached = await get_cached_extraction_async(response_key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        outcome["result"] = cached
+        outcome["cached"] = True
+        return outcome
+
+    try:
+        outcome["result"], outcome["cached"] = await loader.load(raw_text)
+    except (ValueError, RuntimeError) as e:
+        outcome["ai_error"] = str(e)
+        return outcome
+    except Exception as e:
+        outcome["ai_error"] = f"An unexpected error occurred: {e}"
+        return outcome
+
+    return outcome
+
+
+async def _settle_batch(pipelines, user_email: str) -> list[dict]:
+    """Wait for a batch's pipelines, charge its fresh results, then cache them.
+
+    Fresh results are charged with one ``increment_usage`` RPC; cache hits
+    (Supabase or in-process) are free. Only charged results are saved to
+    the response cache, so a failed charge never becomes a free hit later.
+    Returns the outcomes in the same order as ``pipelines``.
+    """
+    outcomes = await asyncio.gather(*(asyncio.wrap_future(p) for p in pipelines))
+    fresh = [o for o in outcomes if o["result"] is not None and not o["cached"]]
+    if not fresh:
+        return outcomes
+
+    try:
+        await increment_upload_count_async(user_email, len(fresh))
+    except Exception as e:
+        for outcome in fresh:
+            outcome["usage_error"] = str(e)
+        return outcomes
+
+    # Best-effort, like the lookup: a failed save only costs a future hit
+    await asyncio.gather(
+        *(save_cached_extraction_async(o["response_key"], o["result"]) for o in fresh),
+        return_exceptions=True,
+    )
+    return outcomes
+
+
+def _process_batch(files, api_key: str, user_email: str, progress_bar) -> list[dict]:
+    """Process every upload concurrently, Groq calls going through the shared loader.
+
+    The pipelines, and the _settle_batch coroutine that charges and caches
+    their results, all run on the shared event loop. Once they are
+    submitted, a rerun or closed tab (which stops this script thread at its
+    next Streamlit call) can no longer leave results cached but uncharged.
+    This thread only waits, updating the progress bar as each file finishes.
+    Returns one outcome dict per file, in the same order as ``files``.
+    """
+    loop = _get_event_loop()
+    extraction_pool = _get_extraction_pool()
+    loader = _get_loader(api_key)
+    futures = {
+        asyncio.run_coroutine_threadsafe(
+            _process_one(uploaded_file, api_key, extraction_pool, loader),
+            loop,
+        ): uploaded_file
+        for uploaded_file in files
+    }
+    settled = asyncio.run_coroutine_threadsafe(
+        _settle_batch(list(futures), user_email), loop
+    )
+
+    total = len(files)
+    for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+        progress_bar.progress(
+            done / total,
+            text=f"Processed {done}/{total}: {futures[future].name}",
+        )
+    return settled.result()
 
 
 # ---------------------------------------------------------------------------
@@ -318,90 +470,89 @@ if uploaded_files:
         )
         st.stop()
 
-    from extraction.extractor import extract_invoice_fields
-
     all_results: list[dict] = []  # collect for master CSV
-    extractions_this_session = 0
 
     progress_bar = st.progress(0, text="Starting extraction...")
 
-    for idx, uploaded_file in enumerate(uploaded_files):
+    outcomes = _process_batch(uploaded_files, api_key, user_email, progress_bar)
+
+    # ✅ Usage was charged in Supabase, one RPC per batch. Cache hits are free.
+    extractions_this_session = sum(
+        1
+        for outcome in outcomes
+        if outcome["result"] is not None
+        and not outcome["cached"]
+        and not outcome["usage_error"]
+    )
+
+    for idx, (uploaded_file, outcome) in enumerate(zip(uploaded_files, outcomes)):
         file_name = uploaded_file.name
-        progress_bar.progress(
-            (idx) / total,
-            text=f"Processing {idx + 1}/{total}: {file_name}",
-        )
 
         with st.expander(f"📄 {file_name}", expanded=(total == 1)):
             col1, col2 = st.columns(2)
 
             # --- Column 1: Raw text extraction ---
-            raw_text = None
+            raw_text = outcome["raw_text"]
             with col1:
                 st.subheader("Extracted Text")
-                with st.spinner("Extracting text..."):
-                    try:
-                        file_type = uploaded_file.type
-                        if file_type == "application/pdf":
-                            raw_text = extract_text_from_pdf(uploaded_file)
-                        else:
-                            raw_text = extract_text_from_image(uploaded_file)
-                        st.text_area(
-                            "Raw Text",
-                            raw_text,
-                            height=350,
-                            disabled=True,
-                            key=f"raw_{idx}",
-                        )
-                    except (ValueError, EnvironmentError) as e:
-                        st.error(str(e))
-                    except Exception as e:
-                        st.error(f"Text extraction failed: {e}")
+                if outcome["text_error"]:
+                    st.error(outcome["text_error"])
+                else:
+                    st.text_area(
+                        "Raw Text",
+                        raw_text,
+                        height=350,
+                        disabled=True,
+                        key=f"raw_{idx}",
+                    )
 
             # --- Column 2: AI extraction ---
             if raw_text:
                 with col2:
                     st.subheader("Structured Output")
-                    with st.spinner("Analysing invoice with AI..."):
-                        try:
-                            result = extract_invoice_fields(raw_text, api_key=api_key)
-
-                            # Separate confidence from fields
-                            confidence = result.pop("confidence", {})
-                            st.json(result)
-
-                            # Confidence display
-                            if confidence:
-                                _render_confidence(confidence)
-
-                            # Per-file JSON download
-                            export_data = {**result, "confidence": confidence}
-                            st.download_button(
-                                label="Download JSON",
-                                data=json.dumps(export_data, indent=2),
-                                file_name=f"invoice_{result.get('invoice_number') or 'unknown'}.json",
-                                mime="application/json",
-                                key=f"dl_{idx}",
-                            )
-
-                            # ✅ Increment usage in Supabase
-                            increment_upload_count(user_email, 1)
-                            extractions_this_session += 1
-
-                            # Add to aggregate (include source filename)
-                            flat = {"source_file": file_name, **result}
-                            # Flatten confidence into the row
-                            for k, v in confidence.items():
-                                flat[f"confidence_{k}"] = v
-                            all_results.append(flat)
-
-                        except (ValueError, RuntimeError) as e:
-                            st.error(str(e))
-                        except Exception as e:
-                            st.error(f"An unexpected error occurred: {e}")
+                    if outcome["ai_error"]:
+                        st.error(outcome["ai_error"])
+                        continue
+
+                    result = outcome["result"]
+
+                    # Separate confidence from fields
+                    confidence = result.pop("confidence", {})
+                    st.json(result)
+
+                    # Confidence display
+                    if confidence:
+                        _render_confidence(confidence)
+
+                    # Per-file JSON download
+                    export_data = {**result, "confidence": confidence}
+                    st.download_button(
+                        label="Download JSON",
+                        data=orjson.dumps(export_data, option=orjson.OPT_INDENT_2),
+                        file_name=f"invoice_{result.get('invoice_number') or 'unknown'}.json",
+                        mime="application/json",
+                        key=f"dl_{idx}",
+                    )
+
+                    if outcome["cached"]:
+                        st.caption("♻️ Served from cache — not counted against your quota.")
+
+                    # Add to aggregate (include source filename)
+                    flat = {"source_file": file_name, **result}
+                    # Flatten confidence into the row
+                    for k, v in confidence.items():
+                        flat[f"confidence_{k}"] = v
+                    all_results.append(flat)
 
     progress_bar.progress(1.0, text=f"Done — {total} invoice(s) processed.")
 
+    usage_errors = [outcome["usage_error"] for outcome in outcomes if outcome["usage_error"]]
+    if usage_errors:
+        st.error(
+            f"Could not record usage for {len(usage_errors)} extraction(s): "
+            f"{usage_errors[0]}. Those results were not cached; please retry later."
+        )
+
     if extractions_this_session > 0:
         new_remaining = remaining - extractions_this_session
         st.info(
@@ -415,17 +566,24 @@ if uploaded_files:
     if all_results:
         st.divider()
         st.header("📊 Master Summary")
+        import pandas as pd
+
         master_df = pd.DataFrame(all_results)
 
         # Prettify column names for display
-        display_df = master_df.copy()
-        display_df.columns = [
-            col.replace("_", " ").title() for col in display_df.columns
-        ]
-        st.dataframe(display_df, use_container_width=True)
-
-        # Master CSV download
-        csv_data = master_df.to_csv(index=False)
+        st.dataframe(
+            master_df.rename(columns=lambda col: col.replace("_", " ").title()),
+            use_container_width=True,
+        )
+
+        # Master CSV download — written straight from the row dicts, keeping
+        # every column any row has, in first-seen order
+        fieldnames = list(dict.fromkeys(key for row in all_results for key in row))
+        csv_buffer = io.StringIO()
+        writer = csv.DictWriter(csv_buffer, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(all_results)
+        csv_data = csv_buffer.getvalue()
         st.download_button(
             label="⬇️ Download Master CSV",
             data=csv_data,
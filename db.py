@@ -1,23 +1,50 @@
-"""Supabase-backed usage tracking for Parserix upload limits."""
+"""Supabase-backed usage tracking and LLM response cache for Parserix."""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
 
 import streamlit as st
-from supabase import create_client, Client
+from supabase import AsyncClient, Client, acreate_client, create_client
 
 MAX_UPLOADS = 10
 
+# Cached Groq extractions are reused for a week
+LLM_CACHE_TTL = timedelta(days=7)
 
-@st.cache_resource
-def get_supabase_client() -> Client:
-    """Initialize and cache the Supabase client from Streamlit secrets."""
+
+def _get_credentials() -> tuple[str, str]:
+    """Return (url, key) for Supabase from Streamlit secrets."""
     try:
-        url = st.secrets["SUPABASE_URL"]
-        key = st.secrets["SUPABASE_KEY"]
+        return st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"]
     except (FileNotFoundError, KeyError) as e:
         raise RuntimeError(
             "Supabase credentials not configured. "
             "Add SUPABASE_URL and SUPABASE_KEY to your Streamlit secrets."
         ) from e
-    return create_client(url, key)
+
+
+@st.cache_resource
+def get_supabase_client() -> Client:
+    """Initialize and cache the Supabase client from Streamlit secrets."""
+    return create_client(*_get_credentials())
+
+
+_async_client: AsyncClient | None = None
+_async_client_lock = asyncio.Lock()
+
+
+async def get_async_supabase_client() -> AsyncClient:
+    """Return the process-wide async Supabase client, creating it on first use.
+
+    Cached in a module global rather than with st.cache_resource, which
+    would cache the coroutine instead of the client. Like the async Groq
+    client, it must only be used from the app's long-lived event loop.
+    """
+    global _async_client
+    async with _async_client_lock:
+        if _async_client is None:
+            _async_client = await acreate_client(*_get_credentials())
+    return _async_client
 
 
 def get_upload_count(email: str) -> int:
@@ -27,48 +54,60 @@ def get_upload_count(email: str) -> int:
         sb.table("usage")
         .select("upload_count")
         .eq("user_email", email.lower().strip())
+        .maybe_single()
         .execute()
     )
-    if response.data:
-        return response.data[0]["upload_count"]
+    # Depending on the client version, a miss is either None or empty data
+    if response and response.data:
+        return response.data["upload_count"]
     return 0
 
 
-def increment_upload_count(email: str, count: int = 1) -> int:
+async def increment_upload_count_async(email: str, count: int = 1) -> int:
     """Increment the upload count for a user. Creates the row if it doesn't exist.
 
+    Runs as a single ``increment_usage`` RPC call, so the read-modify-write
+    happens atomically inside Postgres.
+
     Returns the new total upload count.
     """
     email = email.lower().strip()
-    sb = get_supabase_client()
-
-    current = get_upload_count(email)
-
-    if current == 0:
-        # Check if row exists with 0 count vs doesn't exist
-        response = (
-            sb.table("usage")
-            .select("id")
-            .eq("user_email", email)
-            .execute()
-        )
-        if not response.data:
-            # Insert new row
-            sb.table("usage").insert({
-                "user_email": email,
-                "upload_count": count,
-            }).execute()
-            return count
-
-    # Update existing row
-    new_count = current + count
-    sb.table("usage").update({
-        "upload_count": new_count,
-        "updated_at": "now()",
-    }).eq("user_email", email).execute()
-    return new_count
+    sb = await get_async_supabase_client()
+    response = await sb.rpc(
+        "increment_usage", {"p_email": email, "p_delta": count}
+    ).execute()
+    return response.data
 
 
 def get_remaining_quota(email: str) -> int:
     """Return how many uploads the user has left."""
     return max(0, MAX_UPLOADS - get_upload_count(email))
+
+
+async def get_cached_extraction_async(cache_key: str) -> dict | None:
+    """Return a cached extraction result (fields + confidence), or None on a miss.
+
+    Entries older than LLM_CACHE_TTL are treated as misses.
+    """
+    sb = await get_async_supabase_client()
+    cutoff = datetime.now(timezone.utc) - LLM_CACHE_TTL
+    response = await (
+        sb.table("llm_cache")
+        .select("response_json")
+        .eq("hash", cache_key)
+        .gte("created_at", cutoff.isoformat())
+        .execute()
+    )
+    if response.data:
+        return response.data[0]["response_json"]
+    return None
+
+
+async def save_cached_extraction_async(cache_key: str, result: dict) -> None:
+    """Store (or refresh) the extraction result for a cache key."""
+    sb = await get_async_supabase_client()
+    await sb.table("llm_cache").upsert({
+        "hash": cache_key,
+        "response_json": result,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }, on_conflict="hash").execute()
@@ -1,3 +1,25 @@
-from extraction.extractor import extract_invoice_fields
+from extraction.extractor import (
+    DEFAULT_MODEL,
+    SPEED_MAP,
+    cache_key,
+    estimate_tokens,
+    extract_invoice_fields,
+    extract_invoice_fields_async,
+    extract_invoice_fields_batch,
+    extract_invoice_fields_stream,
+)
+from extraction.loader import ExtractionLoader
+from extraction.rate_limit import AsyncTokenBucket
 
-__all__ = ["extract_invoice_fields"]
+__all__ = [
+    "AsyncTokenBucket",
+    "DEFAULT_MODEL",
+    "ExtractionLoader",
+    "SPEED_MAP",
+    "cache_key",
+    "estimate_tokens",
+    "extract_invoice_fields",
+    "extract_invoice_fields_async",
+    "extract_invoice_fields_batch",
+    "extract_invoice_fields_stream",
+]
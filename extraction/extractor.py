@@ -1,55 +1,85 @@
+import functools
+import hashlib
 import json
 import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
 
-from groq import Groq
-
-SYSTEM_PROMPT = """\
-You are a document extraction assistant specialized in Indian GST Invoices.
-
-Given raw text extracted from an invoice (via PDF text extraction or OCR), extract the following fields:
-
-- vendor_name: The name of the seller/vendor company.
-- vendor_gstin: The vendor's 15-digit GSTIN (Goods and Services Tax Identification Number).
-- invoice_number: The unique invoice identifier.
-- invoice_date: The date of the invoice (return in DD/MM/YYYY format when possible).
-- total_taxable_value: The total taxable amount before GST (as a number).
-- total_gst_amount: The total GST amount including CGST, SGST, and/or IGST (as a number).
-- grand_total: The final total amount including tax (as a number).
-
-Additionally, return a "confidence" object containing an integer score from 0 to 100 for EACH \
-extracted field. The score should reflect how confident you are in the extraction based on:
-- Text clarity: Was the text clearly readable or garbled/partial?
-- Ambiguity: Were there multiple possible values or was the field unambiguous?
-- Format match: Did the extracted value match the expected format (e.g. GSTIN pattern, date format)?
-
-If a field is null (not found), assign a confidence of 0 for that field.
-
-Rules:
-- If a field cannot be found or is ambiguous, return null for that field.
-- For numeric fields, return the number without currency symbols or commas.
-- GSTIN format: 2-digit state code + 10-char PAN + 1 entity code + 1 check digit (e.g., 27AABCU9603R1ZM).
-- Look for CGST + SGST or IGST to compute the total GST amount.
-- Do NOT hallucinate values. Only extract what is clearly present in the text.
-
-You MUST respond with ONLY valid JSON in exactly this structure (no markdown, no explanation):
-{
-  "vendor_name": "<string or null>",
-  "vendor_gstin": "<string or null>",
-  "invoice_number": "<string or null>",
-  "invoice_date": "<string or null>",
-  "total_taxable_value": <number or null>,
-  "total_gst_amount": <number or null>,
-  "grand_total": <number or null>,
-  "confidence": {
-    "vendor_name": <integer 0-100>,
-    "vendor_gstin": <integer 0-100>,
-    "invoice_number": <integer 0-100>,
-    "invoice_date": <integer 0-100>,
-    "total_taxable_value": <integer 0-100>,
-    "total_gst_amount": <integer 0-100>,
-    "grand_total": <integer 0-100>
-  }
-}"""
+import httpx
+from groq import (
+    APIConnectionError,
+    AsyncGroq,
+    AuthenticationError,
+    Groq,
+    InternalServerError,
+    RateLimitError,
+)
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from extraction.rate_limit import AsyncTokenBucket
+
+try:
+    from groq import DefaultAioHttpClient
+except ImportError:  # groq < 0.30 has no aiohttp transport
+    DefaultAioHttpClient = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+_RESULT_SCHEMA = """\
+{"vendor_name":str|null,"vendor_gstin":str|null,"invoice_number":str|null,\
+"invoice_date":str|null,"total_taxable_value":num|null,"total_gst_amount":num|null,\
+"grand_total":num|null,"confidence":{<same 7 keys>:int 0-100}}"""
+
+_RULES = """\
+- vendor = seller; invoice_date as DD/MM/YYYY.
+- Plain numbers, no symbols or commas; total_gst_amount = CGST+SGST, or IGST.
+- GSTIN = 2-digit state + PAN + entity + Z + checksum (15 chars).
+- null if absent or unclear, never guess; confidence 0 if null."""
+
+SYSTEM_PROMPT = (
+    "Extract fields from Indian GST invoice text. "
+    "Reply with ONLY this JSON:\n" + _RESULT_SCHEMA + "\n" + _RULES
+)
+
+# Used by extract_invoice_fields_batch: input is a JSON array of
+# {"id", "text"} invoices, output one result object per id.
+BATCH_SYSTEM_PROMPT = (
+    "Extract fields from each Indian GST invoice in the input "
+    'JSON array of {"id":int,"text":str} items. Reply with ONLY '
+    '{"results":[...]}, one object per input id, each shaped like:\n'
+    '{"id":int,' + _RESULT_SCHEMA[1:] + "\n" + _RULES
+)
+
+# Model per speed tier. The 8B instant model is plenty for pulling seven
+# fields out of invoice text; Scout is there for documents it struggles with.
+SPEED_MAP = {
+    "instant": "llama-3.1-8b-instant",
+    "balanced": "meta-llama/llama-4-scout-17b-16e-instruct",
+}
+DEFAULT_MODEL = SPEED_MAP["instant"]
+
+# Output cap per request. A full answer (7 fields + 7 confidences) is
+# ~180-250 tokens; the cap bounds worst-case generation time.
+MAX_TOKENS = 320
+
+# Token budget (prompt estimate + reserved output) for one
+# extract_invoice_fields_batch request; larger batches are split. Stays
+# inside one minute of the free tier's 6,000 TPM, and caps reserved output
+# at 15 invoices * MAX_TOKENS, well under Groq's per-completion limit.
+BATCH_REQUEST_TOKENS = 5000
+
+# Parsed responses kept in memory, most recently used last
+RESPONSE_CACHE_SIZE = 1024
 
 EXPECTED_FIELDS = [
     "vendor_name",
@@ -61,66 +91,493 @@ EXPECTED_FIELDS = [
     "grand_total",
 ]
 
+# Templates merged under every parsed result
+_DEFAULT_RESULT = {field: None for field in EXPECTED_FIELDS}
+_DEFAULT_CONFIDENCE = {field: 0 for field in EXPECTED_FIELDS}
+
+
+def estimate_tokens(raw_text: str) -> int:
+    """Rough prompt-token count for one request (system prompt + invoice text).
+
+    Uses the usual ~4 characters per token heuristic; only meant for pacing
+    requests against the account's tokens-per-minute limit.
+    """
+    return (len(SYSTEM_PROMPT) + len(raw_text)) // 4
+
+
+_response_cache: OrderedDict[str, dict] = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def cache_key(raw_text: str, model: str = DEFAULT_MODEL) -> str:
+    """Return a key identifying one extraction request (prompt + model + text).
+
+    Completions run at temperature 0, so a request with the same key can be
+    answered from cache instead of calling Groq again.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (SYSTEM_PROMPT, model, raw_text):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _copy_result(result: dict) -> dict:
+    """Copy a result deep enough that callers can't mutate the cached one."""
+    return {**result, "confidence": dict(result["confidence"])}
+
+
+def _cache_get(key: str) -> dict | None:
+    with _response_cache_lock:
+        result = _response_cache.get(key)
+        if result is None:
+            return None
+        _response_cache.move_to_end(key)
+    return _copy_result(result)
+
+
+def _cache_put(key: str, result: dict) -> None:
+    with _response_cache_lock:
+        _response_cache[key] = _copy_result(result)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def _resolve_api_key(api_key: str | None) -> str:
+    """Return the explicit API key or the GROQ_API_KEY env var, raising if neither is set."""
+    key = api_key or os.environ.get("GROQ_API_KEY")
+    if not key:
+        raise ValueError(
+            "Groq API key is not configured. "
+            "Enter it in the sidebar or set the GROQ_API_KEY environment variable."
+        )
+    return key
+
+
+def _completion_kwargs(
+    raw_text: str,
+    model: str,
+    system_prompt: str = SYSTEM_PROMPT,
+    max_tokens: int = MAX_TOKENS,
+) -> dict:
+    """Build the chat-completion request shared by the sync and async paths."""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": raw_text},
+        ],
+        "temperature": 0.0,
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def _parse_result(content: str) -> dict:
+    """Parse the model's JSON reply and fill in any missing fields / confidences."""
+    return _validate_result(_json_loads(content))
+
+
+def _validate_result(result: dict) -> dict:
+    """Return one parsed result with any missing fields / confidences filled in."""
+    result = {**_DEFAULT_RESULT, **result}
+    confidence = result.get("confidence")
+    result["confidence"] = {
+        **_DEFAULT_CONFIDENCE,
+        **(confidence if isinstance(confidence, dict) else {}),
+    }
+    return result
+
+
+# Fallback classification for errors that carry no HTTP status
+_AUTH_RE = re.compile(r"authentication|api key|\b401\b", re.I)
+_RATE_RE = re.compile(r"rate[^a-z]*limit", re.I)
+
+
+def _translate_error(e: Exception) -> Exception:
+    """Map a Groq SDK exception onto the ValueError / RuntimeError the UI expects.
+
+    API errors are classified by type / HTTP status; the message is only
+    searched for errors without a status, so digits or wording in a
+    response body can't misclassify it.
+    """
+    if isinstance(e, json.JSONDecodeError):  # orjson.JSONDecodeError subclasses it
+        return RuntimeError(f"Failed to parse JSON from model response: {e}")
+
+    status = getattr(e, "status_code", None)
+    if status is None:
+        error_msg = str(e)
+        is_auth = bool(_AUTH_RE.search(error_msg))
+        is_rate = not is_auth and bool(_RATE_RE.search(error_msg))
+    else:
+        is_auth = isinstance(e, AuthenticationError) or status == 401
+        is_rate = isinstance(e, RateLimitError) or status == 429
+
+    if is_auth:
+        return ValueError("Invalid Groq API key. Please check your configuration.")
+    if is_rate:
+        return RuntimeError(
+            "Groq rate limit reached. Please wait a moment and retry."
+        )
+    return RuntimeError(f"Groq API call failed: {e}")
+
 
-def extract_invoice_fields(raw_text: str, api_key: str | None = None) -> dict:
-    """Send raw invoice text to Groq (Llama 4 Scout 17B) and return structured fields.
+# Longest Retry-After we'll sleep for before the next attempt
+MAX_RETRY_AFTER = 60.0
+
+_backoff = wait_exponential_jitter(initial=0.5, max=8)
+
+
+def _retry_wait(retry_state) -> float:
+    """Sleep for the server's Retry-After on a 429, else back off with jitter."""
+    e = retry_state.outcome.exception()
+    response = getattr(e, "response", None)
+    if isinstance(e, RateLimitError) and response is not None:
+        headers = response.headers
+        try:
+            if "retry-after-ms" in headers:
+                delay = float(headers["retry-after-ms"]) / 1000
+            else:
+                delay = float(headers["retry-after"])
+            return min(max(delay, 0.0), MAX_RETRY_AFTER)
+        except (KeyError, ValueError):  # absent, or an HTTP date
+            pass
+    return _backoff(retry_state)
+
+
+# Transient failures (429s, dropped connections / timeouts, 5xx) are retried;
+# anything else fails on the first try.
+_retry_transient = retry(
+    stop=stop_after_attempt(4),
+    wait=_retry_wait,
+    retry=retry_if_exception_type(
+        (RateLimitError, APIConnectionError, InternalServerError)
+    ),
+    reraise=True,
+)
+
+
+@_retry_transient
+def _create_completion(client: Groq, **kwargs):
+    return client.chat.completions.create(**kwargs)
+
+
+@_retry_transient
+async def _create_completion_async(
+    client: AsyncGroq, limiter: AsyncTokenBucket | None = None, **kwargs
+):
+    # Each attempt takes its own limiter slot, so retries are paced too
+    if limiter is None:
+        return await client.chat.completions.create(**kwargs)
+    est_tokens = estimate_tokens(kwargs["messages"][-1]["content"])
+    async with limiter.acquire(est_tokens=est_tokens):
+        return await client.chat.completions.create(**kwargs)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_client(key: str) -> Groq:
+    """Return a shared Groq client for ``key`` backed by an HTTP/2 keep-alive pool.
+
+    Reusing one client saves a TCP + TLS handshake on every call after the
+    first.
+    """
+    http_client = httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60.0),
+    )
+    return Groq(api_key=key, http_client=http_client, max_retries=0)
+
+
+def extract_invoice_fields(
+    raw_text: str,
+    api_key: str | None = None,
+    model: str = DEFAULT_MODEL,
+) -> dict:
+    """Send raw invoice text to a Groq-hosted Llama model and return structured fields.
 
     Args:
         raw_text: The extracted text from the invoice document.
         api_key: Groq API key. Falls back to GROQ_API_KEY env var if not provided.
+        model: Groq model ID; see SPEED_MAP for the supported tiers.
 
     Returns:
         A dict with the 7 GST invoice fields plus a confidence object.
 
     Raises:
         ValueError: If no API key is available or the key is invalid.
-        RuntimeError: If the API call fails.
+        RuntimeError: If the API call fails (transient errors are retried first).
     """
-    key = api_key or os.environ.get("GROQ_API_KEY")
-    if not key:
-        raise ValueError(
-            "Groq API key is not configured. "
-            "Enter it in the sidebar or set the GROQ_API_KEY environment variable."
-        )
+    client = _get_client(_resolve_api_key(api_key))
 
-    client = Groq(api_key=key)
+    request_key = cache_key(raw_text, model)
+    cached = _cache_get(request_key)
+    if cached is not None:
+        return cached
 
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": raw_text},
-            ],
-            temperature=0.0,
-            max_tokens=1024,
-            response_format={"type": "json_object"},
+        response = _create_completion(client, **_completion_kwargs(raw_text, model))
+        result = _parse_result(response.choices[0].message.content)
+    except Exception as e:
+        raise _translate_error(e)
+
+    _cache_put(request_key, result)
+    return result
+
+
+def extract_invoice_fields_batch(
+    texts: list[str],
+    api_key: str | None = None,
+    model: str = DEFAULT_MODEL,
+) -> list[dict]:
+    """Extract fields from several invoices with as few Groq requests as fit.
+
+    The system prompt is sent (and prefilled) once per request rather than
+    once per invoice. Invoices already in the response cache are not
+    re-sent. The rest are split into requests of at most
+    BATCH_REQUEST_TOKENS, so a large batch never asks for more output than
+    the model allows or than one minute of the rate limit can cover.
+
+    Returns:
+        One result dict per entry in ``texts``, in the same order. An
+        invoice the model leaves out of its reply gets null fields and
+        zero confidence.
+
+    Raises:
+        ValueError: If no API key is available or the key is invalid.
+        RuntimeError: If the API call fails (transient errors are retried first).
+    """
+    client = _get_client(_resolve_api_key(api_key))
+
+    request_keys = [cache_key(text, model) for text in texts]
+    results = [_cache_get(key) for key in request_keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    for chunk in _batch_chunks(texts, pending):
+        payload = json.dumps(
+            [{"id": i, "text": texts[i]} for i in chunk], ensure_ascii=False
         )
-        content = response.choices[0].message.content
-        result = json.loads(content)
+        try:
+            response = _create_completion(
+                client,
+                **_completion_kwargs(
+                    payload,
+                    model,
+                    system_prompt=BATCH_SYSTEM_PROMPT,
+                    max_tokens=MAX_TOKENS * len(chunk),
+                )
+            )
+            items = _json_loads(response.choices[0].message.content).get("results") or []
+        except Exception as e:
+            raise _translate_error(e)
+
+        # Match replies back by id; models sometimes echo ids as strings
+        by_id = {
+            str(item.pop("id")): item
+            for item in items
+            if isinstance(item, dict) and "id" in item
+        }
+        for i in chunk:
+            item = by_id.get(str(i))
+            if item is None:
+                results[i] = _validate_result({})
+                continue
+            results[i] = _validate_result(item)
+            _cache_put(request_keys[i], results[i])
+    return results
+
+
+def _batch_chunks(texts: list[str], pending: list[int]) -> Iterator[list[int]]:
+    """Split ``pending`` indices into runs that each fit BATCH_REQUEST_TOKENS.
+
+    Uses the same ~4 characters per token estimate as estimate_tokens, plus
+    MAX_TOKENS of reserved output per invoice. An invoice too large to share
+    a request still goes out on its own.
+    """
+    base = len(BATCH_SYSTEM_PROMPT) // 4
+    chunk, used = [], base
+    for i in pending:
+        cost = len(texts[i]) // 4 + MAX_TOKENS
+        if chunk and used + cost > BATCH_REQUEST_TOKENS:
+            yield chunk
+            chunk, used = [], base
+        chunk.append(i)
+        used += cost
+    if chunk:
+        yield chunk
+
+
+_decoder = json.JSONDecoder()
+
+
+def _skip(buf: str, pos: int, chars: str = " \t\r\n") -> int:
+    while pos < len(buf) and buf[pos] in chars:
+        pos += 1
+    return pos
+
+
+def _parse_members(buf: str, pos: int) -> tuple[dict, int]:
+    """Parse the complete ``"key": value`` members of a JSON object in ``buf[pos:]``.
+
+    ``pos`` points just past the opening brace or a previously parsed member.
+    Returns the members parsed and the position to resume from; parsing stops
+    at the first member that hasn't fully arrived yet.
+    """
+    members = {}
+    while True:
+        start = _skip(buf, pos, " \t\r\n,")
+        try:
+            key, i = _decoder.raw_decode(buf, start)
+            i = _skip(buf, i)
+            if buf[i:i + 1] != ":":
+                break
+            value, end = _decoder.raw_decode(buf, _skip(buf, i + 1))
+        except json.JSONDecodeError:
+            break
+        # A value is only complete once the separator after it has arrived;
+        # until then a number like "12" may still be "12.5".
+        after = _skip(buf, end)
+        if buf[after:after + 1] not in (",", "}"):
+            break
+        members[key] = value
+        pos = end
+    return members, pos
+
+
+def extract_invoice_fields_stream(
+    raw_text: str,
+    api_key: str | None = None,
+    model: str = DEFAULT_MODEL,
+) -> Iterator[dict]:
+    """Streaming variant of :func:`extract_invoice_fields`.
+
+    Yields a snapshot dict of the top-level fields parsed so far each time a
+    field completes (``confidence`` arrives whole, once its object closes),
+    so callers can show results from the first token instead of the last.
+    The final item is the validated result, exactly as
+    :func:`extract_invoice_fields` would return it.
 
-        # Validate that expected keys are present
-        for field in EXPECTED_FIELDS:
-            if field not in result:
-                result[field] = None
+    Raises:
+        ValueError: If no API key is available or the key is invalid.
+        RuntimeError: If the API call fails (transient errors are retried first).
+    """
+    client = _get_client(_resolve_api_key(api_key))
 
-        # Ensure confidence object exists with all fields
-        if "confidence" not in result or not isinstance(result["confidence"], dict):
-            result["confidence"] = {}
-        for field in EXPECTED_FIELDS:
-            if field not in result["confidence"]:
-                result["confidence"][field] = 0
+    request_key = cache_key(raw_text, model)
+    cached = _cache_get(request_key)
+    if cached is not None:
+        yield cached
+        return
 
-        return result
+    # Groq's JSON mode doesn't support streaming, so the request goes out
+    # without response_format; the object is cut out of the reply below.
+    request = _completion_kwargs(raw_text, model)
+    del request["response_format"]
 
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"Failed to parse JSON from model response: {e}")
+    try:
+        stream = _create_completion(client, **request, stream=True)
+        content = ""
+        pos = None  # just past the opening brace, once it has arrived
+        partial = {}
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            content += chunk.choices[0].delta.content or ""
+            if pos is None:
+                brace = content.find("{")
+                if brace == -1:
+                    continue
+                pos = brace + 1
+            members, pos = _parse_members(content, pos)
+            if members:
+                partial.update(members)
+                yield dict(partial)
+        if pos is None:
+            raise json.JSONDecodeError("No JSON object in model response", content, 0)
+        # raw_decode ignores any prose or code fence after the object
+        result = _validate_result(_decoder.raw_decode(content, brace)[0])
     except Exception as e:
-        error_msg = str(e).lower()
-        if "authentication" in error_msg or "api key" in error_msg or "401" in error_msg:
-            raise ValueError("Invalid Groq API key. Please check your configuration.")
-        if "rate" in error_msg and "limit" in error_msg:
-            raise RuntimeError(
-                "Groq rate limit reached. Please wait a moment and retry."
-            )
-        raise RuntimeError(f"Groq API call failed: {e}")
+        raise _translate_error(e)
+
+    _cache_put(request_key, result)
+    yield result
+
+
+def _new_async_http_client():
+    """Return the transport for AsyncGroq: aiohttp if available, else HTTP/2 httpx.
+
+    The SDK's aiohttp backend (``groq[aiohttp]``) handles many concurrent
+    requests better than httpx's async transport.
+    """
+    if DefaultAioHttpClient is not None:
+        try:
+            return DefaultAioHttpClient()
+        except RuntimeError:  # aiohttp extra not installed
+            pass
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _get_async_client(key: str) -> AsyncGroq:
+    """Return a shared AsyncGroq client for ``key`` with a keep-alive connection pool.
+
+    Reusing one client saves a TCP + TLS handshake per request and lets
+    concurrent requests share connections. The pool binds to the event loop
+    that first uses it, so drive every call from one long-lived loop.
+    """
+    return AsyncGroq(api_key=key, http_client=_new_async_http_client(), max_retries=0)
+
+
+async def extract_invoice_fields_async(
+    raw_text: str,
+    api_key: str | None = None,
+    client: AsyncGroq | None = None,
+    model: str = DEFAULT_MODEL,
+    limiter: AsyncTokenBucket | None = None,
+) -> dict:
+    """Async counterpart of :func:`extract_invoice_fields`.
+
+    Run several with ``asyncio.gather`` to overlap their round-trips; Groq
+    serves concurrent requests on one key without queueing them.
+
+    Args:
+        raw_text: The extracted text from the invoice document.
+        api_key: Groq API key. Falls back to GROQ_API_KEY env var if not provided.
+        client: Optional ``AsyncGroq`` client. Defaults to a cached client per
+            API key, so repeated calls reuse the same connection pool.
+        model: Groq model ID; see SPEED_MAP for the supported tiers.
+        limiter: Optional rate limiter. Every attempt, retries included,
+            acquires from it before the request goes out.
+
+    Returns:
+        A dict with the 7 GST invoice fields plus a confidence object.
+
+    Raises:
+        ValueError: If no API key is available or the key is invalid.
+        RuntimeError: If the API call fails (transient errors are retried first).
+    """
+    if client is None:
+        client = _get_async_client(_resolve_api_key(api_key))
+
+    request_key = cache_key(raw_text, model)
+    cached = _cache_get(request_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await _create_completion_async(
+            client, limiter, **_completion_kwargs(raw_text, model)
+        )
+        result = _parse_result(response.choices[0].message.content)
+    except Exception as e:
+        raise _translate_error(e)
+
+    _cache_put(request_key, result)
+    return result
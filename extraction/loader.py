@@ -0,0 +1,106 @@
+"""Client-side coalescing of concurrent extraction requests (DataLoader-style)."""
+
+import asyncio
+
+from extraction.extractor import (
+    DEFAULT_MODEL,
+    _cache_get,
+    cache_key,
+    extract_invoice_fields_async,
+)
+from extraction.rate_limit import AsyncTokenBucket
+
+
+class ExtractionLoader:
+    """Collect extraction requests over a short window and dispatch them together.
+
+    ``await loader.load(raw_text)`` queues a request and waits for its
+    result. A background task drains the queue: it takes everything that
+    arrives within ``window`` seconds of the first request (up to
+    ``max_batch_size``) and fires those as parallel Groq calls. At most
+    ``max_concurrency`` calls are in flight across every caller sharing the
+    loader, and each attempt (retries included) is paced by ``limiter`` if
+    one is given.
+
+    The queue and drain task are bound to the event loop of the first
+    ``load()``, so share one loader only among callers on that loop.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        model: str = DEFAULT_MODEL,
+        limiter: AsyncTokenBucket | None = None,
+        window: float = 0.01,
+        max_batch_size: int = 16,
+        max_concurrency: int = 16,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.limiter = limiter
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queue: asyncio.Queue | None = None
+        self._drainer: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()  # keep dispatches referenced
+
+    async def load(self, raw_text: str) -> tuple[dict, bool]:
+        """Extract fields from ``raw_text``, raising the same errors as extract_invoice_fields_async.
+
+        Returns:
+            ``(result, cached)``: ``cached`` is True when the result came from
+            the in-process response cache and no Groq request was made.
+        """
+        loop = asyncio.get_running_loop()
+        if self._drainer is None or self._drainer.done():
+            self._queue = asyncio.Queue()
+            self._drainer = loop.create_task(self._drain())
+        future = loop.create_future()
+        await self._queue.put((raw_text, future))
+        return await future
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            for raw_text, future in batch:
+                task = loop.create_task(self._dispatch(raw_text, future))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, raw_text: str, future: asyncio.Future) -> None:
+        request_key = cache_key(raw_text, self.model)
+        # Answer in-process cache hits without taking a slot or rate budget
+        cached = _cache_get(request_key)
+        if cached is None:
+            try:
+                async with self._semaphore:
+                    # Look again: an identical request may have finished while
+                    # this one waited. Nothing awaits between this check and the
+                    # extractor's own, so a None here means a real Groq call.
+                    cached = _cache_get(request_key)
+                    if cached is None:
+                        result = await extract_invoice_fields_async(
+                            raw_text,
+                            api_key=self.api_key,
+                            model=self.model,
+                            limiter=self.limiter,
+                        )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+        if not future.done():
+            future.set_result((result, False) if cached is None else (cached, True))
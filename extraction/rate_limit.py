@@ -0,0 +1,62 @@
+"""Client-side pacing for Groq's per-minute request and token limits."""
+
+import asyncio
+import contextlib
+import threading
+import time
+
+
+class AsyncTokenBucket:
+    """Token bucket that keeps callers under a requests/min and tokens/min cap.
+
+    Both budgets start full and refill continuously. Refills are computed
+    lazily from elapsed time under a thread lock instead of by a background
+    task, so the bucket is not tied to any one event loop or thread.
+
+    Usage::
+
+        async with bucket.acquire(est_tokens=1200):
+            await client.chat.completions.create(...)
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def _try_take(self, tokens: int) -> float:
+        """Take one request + ``tokens`` if available, else return seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0.0
+            request_wait = (1 - self._requests) * 60 / self.requests_per_minute
+            token_wait = (tokens - self._tokens) * 60 / self.tokens_per_minute
+            return max(request_wait, token_wait, 0.0)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, est_tokens: int = 0):
+        """Wait until one request slot and ``est_tokens`` tokens are available."""
+        # A single oversized request must still go through eventually.
+        tokens = min(max(est_tokens, 0), self.tokens_per_minute)
+        while (delay := self._try_take(tokens)) > 0:
+            await asyncio.sleep(delay)
+        yield
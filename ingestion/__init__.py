@@ -0,0 +1,3 @@
+from ingestion.reader import extract_text_from_image, extract_text_from_pdf
+
+__all__ = ["extract_text_from_image", "extract_text_from_pdf"]
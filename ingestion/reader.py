@@ -0,0 +1,160 @@
+"""Text extraction from uploaded invoice files (PDF text layer, or Tesseract OCR)."""
+
+import functools
+import io
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Tesseract's OpenMP threading scales poorly and fights the process pool for
+# cores; run each OCR single-threaded and parallelise across pages instead.
+# Must be set before pytesseract / tesseract is first used.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Resolution scanned pages are rendered at for OCR. 200 dpi is plenty for
+# typical invoice scans; set OCR_DPI=300 for small print or poor scans.
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+
+
+# ---------------------------------------------------------------------------
+# Tesseract availability check (lazy — only when OCR is actually needed)
+# ---------------------------------------------------------------------------
+
+# Try the common Windows install path if Tesseract isn't on PATH. Done at
+# import so OCR worker processes pick it up too.
+_WINDOWS_TESSERACT = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+if sys.platform == "win32" and os.path.isfile(_WINDOWS_TESSERACT):
+    import pytesseract
+
+    pytesseract.pytesseract.tesseract_cmd = _WINDOWS_TESSERACT
+
+
+@functools.lru_cache(maxsize=1)
+def _check_tesseract() -> bool:
+    """Return True if Tesseract is available, False otherwise.
+
+    Cached: the probe spawns ``tesseract --version``, and the answer can't
+    change without restarting the app.
+    """
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Text extraction helpers
+# ---------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=1)
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Return the worker pool shared by all page-parallel OCR.
+
+    Workers are started by a forkserver (spawn where that's unavailable)
+    rather than by forking the app: the Streamlit server runs tornado, the
+    I/O event-loop thread and aiohttp, and forking a multi-threaded process
+    can deadlock the child.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(mp_context=context)
+
+
+def _ocr_page(width: int, height: int, samples: bytes) -> str:
+    """Worker: OCR one page rendered as raw 8-bit grayscale samples."""
+    import pytesseract
+    from PIL import Image
+
+    img = Image.frombytes("L", (width, height), samples)
+    return pytesseract.image_to_string(img, lang="eng")
+
+
+def _ocr_pages(pages: list[tuple[int, int, bytes]]) -> list[str]:
+    """OCR rendered pages, one page per worker process when there are several."""
+    if len(pages) > 1:
+        return list(_get_process_pool().map(_ocr_page, *zip(*pages)))
+    return [_ocr_page(*page) for page in pages]
+
+
+def _is_blank(text: str) -> bool:
+    """True for empty or whitespace-only text, without building a stripped copy."""
+    return not text or text.isspace()
+
+
+def extract_text_from_pdf(file_bytes: bytes) -> str:
+    """Extract text from a PDF in a single PyMuPDF pass.
+
+    Pages with a text layer are read directly; pages that come back empty
+    (scans) are rendered and OCR'd with Tesseract.
+    """
+    import fitz  # PyMuPDF
+
+    page_texts = []
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        for page in doc:
+            # A page that uses no fonts can't have a text layer, so scanned
+            # pages skip the text extractor entirely.
+            page_texts.append(page.get_text("text") if page.get_fonts() else "")
+
+        ocr_indexes = [i for i, text in enumerate(page_texts) if _is_blank(text)]
+        has_text_layer = len(ocr_indexes) < len(page_texts)
+        if ocr_indexes:
+            if not _check_tesseract():
+                if not has_text_layer:
+                    raise EnvironmentError(
+                        "Tesseract OCR is not installed. This scanned PDF requires OCR.\n\n"
+                        "**Install Tesseract on Windows:**\n"
+                        "1. Download from https://github.com/UB-Mannheim/tesseract/wiki\n"
+                        "2. Install and add to your system PATH.\n"
+                        "3. Restart this app."
+                    )
+                ocr_indexes = []
+
+            # Rendered only once we know OCR will run. Grayscale is all
+            # Tesseract needs (it binarizes internally) and is a third of
+            # the RGB pixel data to render and ship to workers.
+            pages = []
+            for i in ocr_indexes:
+                pix = doc[i].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+                pages.append((pix.width, pix.height, pix.samples))
+
+    if ocr_indexes:
+        for i, ocr_text in zip(ocr_indexes, _ocr_pages(pages)):
+            page_texts[i] = ocr_text
+
+    text_parts = [text for text in page_texts if not _is_blank(text)]
+    if not text_parts:
+        raise ValueError(
+            "Could not extract any text from this scanned PDF. "
+            "Please ensure the document is legible."
+        )
+    return "\n".join(text_parts)
+
+
+def extract_text_from_image(file_bytes: bytes) -> str:
+    """Extract text from an image using Pillow + Tesseract OCR."""
+    import pytesseract
+    from PIL import Image
+
+    if not _check_tesseract():
+        raise EnvironmentError(
+            "Tesseract OCR is not installed.\n\n"
+            "**Install Tesseract on Windows:**\n"
+            "1. Download from https://github.com/UB-Mannheim/tesseract/wiki\n"
+            "2. Install and add to your system PATH.\n"
+            "3. Restart this app."
+        )
+
+    image = Image.open(io.BytesIO(file_bytes))
+    text = pytesseract.image_to_string(image, lang="eng")
+    if _is_blank(text):
+        raise ValueError(
+            "OCR could not extract any text from this image. "
+            "Ensure the image is clear and contains readable text."
+        )
+    return text
@@ -0,0 +1,6 @@
+-- Cache of Groq extraction results, keyed by a hash of the invoice text.
+create table if not exists llm_cache (
+    hash text primary key,
+    response_json jsonb not null,
+    created_at timestamptz not null default now()
+);
@@ -0,0 +1,25 @@
+-- Atomically add p_delta to a user's upload count, creating the row on first
+-- use, and return the new total. Lets the app account for a whole batch in
+-- a single round-trip.
+create or replace function increment_usage(p_email text, p_delta int)
+returns int
+language plpgsql
+as $$
+declare
+    new_count int;
+begin
+    update usage
+       set upload_count = upload_count + p_delta,
+           updated_at = now()
+     where user_email = p_email
+    returning upload_count into new_count;
+
+    if not found then
+        insert into usage (user_email, upload_count)
+        values (p_email, p_delta)
+        returning upload_count into new_count;
+    end if;
+
+    return new_count;
+end;
+$$;
@@ -0,0 +1,35 @@
+-- One usage row per user: index user_email so quota lookups are a single
+-- index probe, and let increment_usage upsert with ON CONFLICT.
+
+-- Fold any duplicate rows left by the old check-then-insert code into the
+-- oldest row for that email before adding the constraint.
+with totals as (
+    select user_email, min(id) as keep_id, sum(upload_count) as upload_count
+      from usage
+     group by user_email
+    having count(*) > 1
+)
+update usage
+   set upload_count = totals.upload_count,
+       updated_at = now()
+  from totals
+ where usage.id = totals.keep_id;
+
+delete from usage
+ using usage as kept
+ where usage.user_email = kept.user_email
+   and usage.id > kept.id;
+
+alter table usage add constraint usage_user_email_key unique (user_email);
+
+create or replace function increment_usage(p_email text, p_delta int)
+returns int
+language sql
+as $$
+    insert into usage (user_email, upload_count)
+    values (p_email, p_delta)
+    on conflict (user_email) do update
+        set upload_count = usage.upload_count + excluded.upload_count,
+            updated_at = now()
+    returning upload_count;
+$$;